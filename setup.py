@@ -1,4 +1,6 @@
-from setuptools import setup, find_packages
+import os
+
+from setuptools import setup, find_packages, Extension
 from Cython.Build import cythonize
 import Cython.Compiler
 import numpy as np
@@ -6,6 +8,12 @@ import numpy as np
 # Allows cimport'ing PBCCalculator
 Cython.Compiler.Options.cimport_from_pyx = True
 
+# OpenMP is opt-in, since the flag depends on the compiler: set
+# SITATOR_OPENMP_FLAG to e.g. `-fopenmp` (GCC) or `/openmp` (MSVC) to
+# parallelize the SOAP accumulation. Without it, those loops run serially.
+openmp_flag = os.environ.get("SITATOR_OPENMP_FLAG")
+openmp_args = [openmp_flag] if openmp_flag else []
+
 setup(
     name = 'sitator',
     version = '2.0.0',
@@ -18,6 +26,12 @@ setup(
     ext_modules = cythonize(
         [
         "sitator/landmark/helpers.pyx",
+        Extension(
+            "sitator.site_descriptors.helpers",
+            ["sitator/site_descriptors/helpers.pyx"],
+            extra_compile_args = openmp_args,
+            extra_link_args = openmp_args
+        ),
         "sitator/util/*.pyx",
         "sitator/dynamics/*.pyx",
         "sitator/misc/*.pyx"
@@ -31,7 +45,8 @@ setup(
         "matplotlib",
         "ase",
         "tqdm",
-        "sklearn"
+        "sklearn",
+        "joblib"
     ],
     extras_require = {
         "SiteTypeAnalysis" : [
@@ -4,6 +4,7 @@ from abc import ABCMeta, abstractmethod
 
 from sitator import SiteNetwork, SiteTrajectory
 from sitator.util.progress import tqdm
+from . import helpers
 
 from ase.data import atomic_numbers
 
@@ -36,7 +37,8 @@ class SOAP(object, metaclass=ABCMeta):
         along with tracer atoms, returns SOAP vectors in a numpy array. (i.e.
         its signature is ``soap(structure, positions)``). The returned function
         can also have a property, ``n_dim``, giving the length of a single SOAP
-        vector.
+        vector, and a ``batch(structures, positions)`` function computing the
+        SOAPs of several structures at once and returning them concatenated.
     """
 
     from .backend.quip import quip_soap_backend as backend_quip
@@ -100,7 +102,7 @@ class SOAP(object, metaclass=ABCMeta):
             environment_list = self._environment
         else:
             # Set it to all species represented by the soap_mask
-            environment_list = np.unique(sn.structure.get_atomic_numbers()[soap_mask])
+            environment_list = np.unique(sn.structure.numbers[soap_mask])
 
         soaper = self._backend(sn, soap_mask, tracer_atomic_number, environment_list)
 
@@ -110,6 +112,8 @@ class SOAP(object, metaclass=ABCMeta):
     # ----
 
     def _make_structure(self, sn):
+        # `numbers` is the structure's own array; `get_atomic_numbers()` copies it
+        numbers = sn.structure.numbers
 
         if self._soap_mask is None:
             # Make a copy of the static structure
@@ -117,7 +121,8 @@ class SOAP(object, metaclass=ABCMeta):
             soap_mask = sn.static_mask # soap mask is the
         else:
             if isinstance(self._soap_mask, tuple):
-                soap_mask = np.in1d(sn.structure.get_chemical_species(), self._soap_mask)
+                species = [atomic_numbers[e] if isinstance(e, str) else e for e in self._soap_mask]
+                soap_mask = np.isin(numbers, species)
             else:
                 soap_mask = self._soap_mask
 
@@ -126,15 +131,15 @@ class SOAP(object, metaclass=ABCMeta):
 
         assert np.any(soap_mask), "Given `soap_mask` excluded all host atoms."
         if not self._environment is None:
-            assert np.any(np.isin(sn.structure.get_atomic_numbers()[soap_mask], self._environment)), "Combination of given `soap_mask` with the given `environment` excludes all host atoms."
+            assert np.any(np.isin(numbers[soap_mask], self._environment)), "Combination of given `soap_mask` with the given `environment` excludes all host atoms."
 
         # Add a tracer
         if self.tracer_atomic_number is None:
-            tracer_atomic_number = sn.structure.get_atomic_numbers()[sn.mobile_mask][0]
+            tracer_atomic_number = numbers[sn.mobile_mask][0]
         else:
             tracer_atomic_number = self.tracer_atomic_number
 
-        if np.any(structure.get_atomic_numbers() == tracer_atomic_number):
+        if np.any(structure.numbers == tracer_atomic_number):
             raise ValueError("Structure cannot have static atoms (that are enabled in the SOAP mask) of the same species as `tracer_atomic_number`.")
 
         structure.set_pbc([True, True, True])
@@ -210,19 +215,32 @@ class SOAPDescriptorAverages(SOAP):
         site. This does not guerantee that number of SOAP vectors for any site,
         rather, it allows a trajectory-size agnostic way to specify approximately
         how many descriptors are desired.
+    :param int batch_size: How many frames' SOAPs to compute in a single call
+        to the backend, if it supports batches. Default 32.
+    :param dtype: The dtype of the averaged SOAP vectors, ``np.float64``
+        (default) or ``np.float32``. Single precision halves the memory needed
+        for the output; the averages then carry roughly seven significant
+        digits, which is usually plenty for comparing sites.
 
     """
     def __init__(self, *args, **kwargs):
 
         averaging_key = 'averaging'
         stepsize_key = 'stepsize'
+        batch_size_key = 'batch_size'
         avg_desc_per_key = 'avg_descriptors_per_site'
 
         assert not ((averaging_key in kwargs) and (avg_desc_per_key in kwargs)), "`averaging` and `avg_descriptors_per_site` cannot be specified at the same time."
 
         self._stepsize = kwargs.pop(stepsize_key, 1)
 
-        d = {stepsize_key : self._stepsize}
+        self._batch_size = kwargs.pop(batch_size_key, 32)
+
+        self._dtype = np.dtype(kwargs.pop('dtype', np.float64))
+        if self._dtype not in (np.float32, np.float64):
+            raise ValueError("dtype has to be np.float32 or np.float64")
+
+        d = {stepsize_key : self._stepsize, batch_size_key : self._batch_size}
 
         if averaging_key in kwargs:
             self._averaging = kwargs.pop(averaging_key)
@@ -256,14 +274,20 @@ class SOAPDescriptorAverages(SOAP):
         # real_traj is the real space positions, site_traj the site trajectory
         # (i.e. for every mobile species the site index)
         real_traj = site_trajectory._real_traj[::self._stepsize]
-        site_traj = site_trajectory.traj[::self._stepsize]
+        # (the compiled helpers need np.intp site indexes; this only copies
+        # for other integer dtypes)
+        site_traj = np.asarray(site_trajectory.traj[::self._stepsize], dtype = np.intp)
 
         # Now, I need to allocate the output
         # so for each site, I count how much data there is!
-        counts = np.zeros(shape = nsit + 1, dtype = np.int)
-        for frame in site_traj:
-            counts[frame] += 1 # A duplicate in `frame` will still only cause a single addition due to Python rules.
-        counts = counts[:-1]
+        # A site occupied by more than one mobile atom in a frame is only
+        # counted once for that frame, so drop repeats within each frame.
+        sorted_frames = np.sort(site_traj, axis = 1)
+        first_in_frame = np.ones(shape = sorted_frames.shape, dtype = np.bool_)
+        first_in_frame[:, 1:] = sorted_frames[:, 1:] != sorted_frames[:, :-1]
+        occupied = sorted_frames[first_in_frame & (sorted_frames != SiteTrajectory.SITE_UNKNOWN)]
+        counts = np.bincount(occupied, minlength = nsit)
+        del sorted_frames, first_in_frame, occupied
 
         if self._averaging is not None:
             averaging = self._averaging
@@ -285,36 +309,95 @@ class SOAPDescriptorAverages(SOAP):
         assert np.all(nr_of_descs >= 1)
         logger.debug("Minimum # of descriptors/site: %i; maximum: %i" % (np.min(nr_of_descs), np.max(nr_of_descs)))
         # This is where I load the descriptor:
-        descs = np.zeros(shape = (np.sum(nr_of_descs), soaper.n_dim))
+        descs = np.zeros(shape = (np.sum(nr_of_descs), soaper.n_dim), dtype = self._dtype)
 
         # An array that tells  me the index I'm at for each site type
-        desc_index = np.asarray([np.sum(nr_of_descs[:i]) for i in range(len(nr_of_descs))])
-        max_index = np.asarray([np.sum(nr_of_descs[:i+1]) for i in range(len(nr_of_descs))])
-
-        count_of_site = np.zeros(len(nr_of_descs), dtype=int)
-        allowed = np.ones(nsit, dtype = np.bool)
+        # (np.intp is 64 bits on 64-bit platforms, so very large outputs
+        # can still be indexed)
+        max_index = np.cumsum(nr_of_descs, dtype = np.intp)
+        desc_index = max_index - nr_of_descs
+
+        averagings = averagings.astype(np.intp)
+        # Each SOAP is scaled as it is accumulated, by a multiplication; sites
+        # with an averaging of 0 are never described.
+        inv_averagings = 1.0 / np.maximum(averagings, 1)
+        count_of_site = np.zeros(len(nr_of_descs), dtype = np.intp)
+        # Sites that are never occupied have nothing to average
+        allowed = (averagings > 0).astype(np.uint8)
+
+        # The host atoms never change, so gather them by index
+        soap_idx = np.flatnonzero(soap_mask)
+        # np.take can only write straight into the structure without casting
+        take_positions = real_traj.dtype == structure.positions.dtype
+
+        # Scratch buffers for choosing which mobile atoms to describe
+        taken = np.zeros(nsit, dtype = np.uint8)
+        atoms_to_describe = np.empty(len(mob_indices), dtype = np.intp)
+
+        # Which sites get described when only depends on the site trajectory,
+        # so the bookkeeping runs ahead and the SOAPs are computed in batches
+        # of frames. The structures and buffers of one batch are reused for
+        # the next.
+        n_batch = min(self._batch_size, len(site_traj))
+        structure_pool = [structure.copy() for _ in range(n_batch)]
+        batch_positions = []
+        batch_sites = np.empty(n_batch * len(mob_indices), dtype = np.intp)
+        batch_rows = np.empty(n_batch * len(mob_indices), dtype = np.intp)
+        n_in_batch = 0
+
+        def flush_batch():
+            soaps = _soap_batch(soaper, structure_pool[:len(batch_positions)], batch_positions)
+            # Backends may return any float dtype
+            soaps = np.asarray(soaps, dtype = np.float64)
+            helpers.accumulate_soaps(batch_rows[:n_in_batch], batch_sites[:n_in_batch],
+                                     soaps, inv_averagings, descs)
+            del batch_positions[:]
 
         for site_traj_t, pos in zip(tqdm(site_traj, desc="SOAP Frame"), real_traj):
-            # I update the host lattice positions here, once for every timestep
-            structure.positions[:] = pos[soap_mask]
+            n_to_describe = helpers.select_to_describe(site_traj_t, mob_indices,
+                                                       allowed, taken,
+                                                       atoms_to_describe, batch_sites[n_in_batch:])
 
-            to_describe = (site_traj_t != SiteTrajectory.SITE_UNKNOWN) & allowed[site_traj_t]
+            # Reset and increment full averages
+            helpers.advance_frame(batch_sites[n_in_batch:n_in_batch + n_to_describe],
+                                  averagings, desc_index, max_index,
+                                  count_of_site, allowed, batch_rows[n_in_batch:])
 
-            if np.any(to_describe):
-                sites_to_describe = site_traj_t[to_describe]
-                soaps = soaper(structure, pos[mob_indices[to_describe]])
-                soaps /= averagings[sites_to_describe][:, np.newaxis]
-                idx_to_add_desc = desc_index[sites_to_describe]
-                descs[idx_to_add_desc] += soaps
-                count_of_site[sites_to_describe] += 1
+            if n_to_describe == 0:
+                continue
 
-            # Reset and increment full averages
-            full_average = count_of_site == averagings
-            desc_index[full_average] += 1
-            count_of_site[full_average] = 0
-            allowed[max_index == desc_index] = False
+            # The host lattice as it was at this timestep
+            frame_structure = structure_pool[len(batch_positions)]
+            if take_positions:
+                np.take(pos, soap_idx, axis = 0, out = frame_structure.positions)
+            else:
+                frame_structure.positions[:] = pos[soap_idx]
+            batch_positions.append(pos[atoms_to_describe[:n_to_describe]])
+            n_in_batch += n_to_describe
+
+            if len(batch_positions) == n_batch:
+                flush_batch()
+                n_in_batch = 0
+
+        if len(batch_positions) > 0:
+            flush_batch()
 
         assert not np.any(allowed) # We should have maxed out all of them after processing all frames.
 
-        desc_to_site = np.repeat(list(range(nsit)), nr_of_descs)
+        desc_to_site = np.repeat(np.arange(nsit), nr_of_descs)
         return descs, desc_to_site
+
+
+def _soap_batch(soaper, structures, positions):
+    """Compute the SOAPs for several frames at once.
+
+    Uses the backend's ``batch`` function when it has one, otherwise calls it
+    once per frame.
+
+    Returns:
+        The SOAP vectors of all frames, concatenated in order.
+    """
+    if hasattr(soaper, 'batch'):
+        return soaper.batch(structures, positions)
+    else:
+        return np.concatenate([soaper(s, p) for s, p in zip(structures, positions)])
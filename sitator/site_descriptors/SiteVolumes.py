@@ -1,8 +1,12 @@
 import numpy as np
 
+import itertools
+
 from scipy.spatial import ConvexHull
 from scipy.spatial.qhull import QhullError
 
+from joblib import Parallel, delayed, effective_n_jobs
+
 from sitator import SiteNetwork, SiteTrajectory
 from sitator.util import PBCCalculator
 
@@ -22,9 +26,12 @@ class SiteVolumes(object):
             If ``True``, an error will be thrown when a site with less than four
             vertices is encountered; if ``False``, a volume of 0  and surface area
             of NaN will be returned.
+        n_jobs (int): How many processes to compute the volumes of different
+            sites in; ``-1`` uses all CPUs.
     """
-    def __init__(self, error_on_insufficient_coord = True):
+    def __init__(self, error_on_insufficient_coord = True, n_jobs = -1):
         self.error_on_insufficient_coord = error_on_insufficient_coord
+        self.n_jobs = n_jobs
 
 
     def compute_accessable_volumes(self, st, n_recenterings = 8):
@@ -43,36 +50,25 @@ class SiteVolumes(object):
                 where recentering around it gives very bad results.)
         """
         assert isinstance(st, SiteTrajectory)
-        vols = np.empty(shape = st.site_network.n_sites, dtype = np.float)
-        areas = np.empty(shape = st.site_network.n_sites, dtype = np.float)
-
-        pbcc = PBCCalculator(st.site_network.structure.cell)
-
-        for site in range(st.site_network.n_sites):
-            pos = st.real_positions_for_site(site)
+        vols = np.empty(shape = st.site_network.n_sites, dtype = np.float64)
+        areas = np.empty(shape = st.site_network.n_sites, dtype = np.float64)
 
-            assert pos.flags['OWNDATA']
+        cell = st.site_network.structure.cell[:]
 
-            vol = np.inf
-            area = None
-            for i in range(n_recenterings):
-                # Recenter
-                offset = pbcc.cell_centroid - pos[int(i * (len(pos)/n_recenterings))]
-                pos += offset
-                pbcc.wrap_points(pos)
+        positions = [st.real_positions_for_site(site) for site in range(st.site_network.n_sites)]
+        assert all(pos.flags['OWNDATA'] for pos in positions)
 
-                try:
-                    hull = ConvexHull(pos)
-                except QhullError as qhe:
-                    logger.warning("For site %i, iter %i: %s" % (site, i, qhe))
-                    vols[site] = np.nan
-                    areas[site] = np.nan
-                    continue
-
-                if hull.volume < vol:
-                    vol = hull.volume
-                    area = hull.area
+        results = self._map_site_chunks(
+            _accessable_volumes_for_sites,
+            [(positions[start:stop], cell, n_recenterings)
+             for start, stop in self._site_chunks(len(positions))]
+        )
 
+        for site, (vol, area, failures) in enumerate(results):
+            if len(positions[site]) < 4:
+                logger.warning("Site %i only has %i positions; setting its volume to NaN" % (site, len(positions[site])))
+            for i, qhe in failures:
+                logger.warning("For site %i, iter %i: %s" % (site, i, qhe))
             vols[site] = vol
             areas[site] = area
 
@@ -95,35 +91,40 @@ class SiteVolumes(object):
         if sn.vertices is None:
             raise ValueError("SiteNetwork must have verticies to compute volumes!")
 
-        vols = np.empty(shape = sn.n_sites, dtype = np.float)
-        areas = np.empty(shape = sn.n_sites, dtype = np.float)
-
-        pbcc = PBCCalculator(sn.structure.cell)
-
-        for site in range(sn.n_sites):
-            pos = sn.static_structure.positions[list(sn.vertices[site])]
-            if len(pos) < 4:
-                if self.error_on_insufficient_coord:
-                    raise InsufficientCoordinatingAtomsError("Site %i had only %i vertices (less than needed 4)" % (site, len(pos)))
-                else:
-                    vols[site] = 0
-                    areas[site] = np.nan
-                    continue
-
-            assert pos.flags['OWNDATA'] # It should since we're indexing with index lists
-            # Recenter
-            offset = pbcc.cell_centroid - sn.centers[site]
-            pos += offset
-            pbcc.wrap_points(pos)
-
-            try:
-                hull = ConvexHull(pos)
-                vols[site] = hull.volume
-                areas[site] = hull.area
-            except QhullError as qhe:
+        vols = np.empty(shape = sn.n_sites, dtype = np.float64)
+        areas = np.empty(shape = sn.n_sites, dtype = np.float64)
+
+        cell = sn.structure.cell[:]
+
+        n_verts = np.fromiter((len(v) for v in sn.vertices), dtype = np.intp, count = sn.n_sites)
+        if self.error_on_insufficient_coord and np.any(n_verts < 4):
+            site = np.argmax(n_verts < 4)
+            raise InsufficientCoordinatingAtomsError("Site %i had only %i vertices (less than needed 4)" % (site, n_verts[site]))
+
+        # Gather all sites' vertex positions into one buffer (a copy, since
+        # they are recentered in place) and give each site a view of its part
+        offsets = np.concatenate(([0], np.cumsum(n_verts)))
+        vert_idex = np.fromiter(itertools.chain.from_iterable(sn.vertices), dtype = np.intp, count = offsets[-1])
+        all_pos = np.take(sn.static_structure.positions, vert_idex, axis = 0)
+        # Each worker gets one contiguous part of the buffer
+        centers = np.asarray(sn.centers)
+        results = self._map_site_chunks(
+            _volumes_for_sites,
+            [(all_pos[offsets[start]:offsets[stop]],
+              offsets[start:stop + 1] - offsets[start],
+              centers[start:stop],
+              cell)
+             for start, stop in self._site_chunks(sn.n_sites)]
+        )
+
+        for site, (vol, area) in enumerate(results):
+            if vol is None:
                 logger.warning("Had QHull failure when computing volume of site %i" % site)
                 vols[site] = np.nan
                 areas[site] = np.nan
+            else:
+                vols[site] = vol
+                areas[site] = area
 
         sn.add_site_attribute('site_volumes', vols)
         sn.add_site_attribute('site_surface_areas', areas)
@@ -132,3 +133,90 @@ class SiteVolumes(object):
     def run(self, st):
         """For backwards compatability."""
         self.compute_accessable_volumes(st)
+
+
+    def _site_chunks(self, n_sites):
+        """Split ``range(n_sites)`` into one contiguous ``(start, stop)`` per worker."""
+        n_chunks = max(1, min(effective_n_jobs(self.n_jobs), n_sites))
+        bounds = np.linspace(0, n_sites, n_chunks + 1).astype(np.intp)
+        return list(zip(bounds[:-1], bounds[1:]))
+
+
+    def _map_site_chunks(self, func, chunk_args):
+        """Call ``func`` on each chunk's arguments and concatenate the per-site results."""
+        if len(chunk_args) == 1:
+            # Not worth starting workers for
+            results = [func(*chunk_args[0])]
+        else:
+            results = Parallel(n_jobs = len(chunk_args), backend = 'loky', max_nbytes = None)(
+                delayed(func)(*args) for args in chunk_args
+            )
+        return list(itertools.chain.from_iterable(results))
+
+
+def _accessable_volumes_for_sites(positions, cell, n_recenterings):
+    """``_accessable_volume_for_site`` for each of ``positions``."""
+    pbcc = PBCCalculator(cell)
+    return [_accessable_volume_for_site(pos, pbcc, n_recenterings) for pos in positions]
+
+
+def _volumes_for_sites(all_pos, offsets, centers, cell):
+    """``_volume_for_site`` for each site, whose points are ``all_pos[offsets[i]:offsets[i + 1]]``."""
+    pbcc = PBCCalculator(cell)
+    return [_volume_for_site(all_pos[offsets[i]:offsets[i + 1]], centers[i], pbcc)
+            for i in range(len(centers))]
+
+
+def _accessable_volume_for_site(pos, pbcc, n_recenterings):
+    """Minimal convex hull volume of ``pos`` over ``n_recenterings`` recenterings.
+
+    Returns:
+        The volume, the corresponding surface area (both NaN for less than
+        four points), and a list of
+        ``(recentering, QHull error message)`` for the recenterings on which QHull failed.
+    """
+    if len(pos) < 4:
+        return np.nan, np.nan, []
+
+    # Every recentering starts again from the original points
+    pos0 = pos.copy()
+
+    vol = np.inf
+    area = None
+    failures = []
+    for i in range(n_recenterings):
+        # Recenter
+        pbcc.recenter_points(pos0, pos0[int(i * (len(pos0)/n_recenterings))], pos)
+
+        try:
+            hull = ConvexHull(pos)
+        except QhullError as qhe:
+            failures.append((i, str(qhe)))
+            continue
+
+        if hull.volume < vol:
+            vol = hull.volume
+            area = hull.area
+
+    return vol, area, failures
+
+
+def _volume_for_site(pos, center, pbcc):
+    """Volume and surface area of the convex hull of ``pos`` around ``center``.
+
+    Returns:
+        ``(volume, area)``; ``(0, NaN)`` for less than four points and
+        ``(None, None)`` if QHull fails.
+    """
+    if len(pos) < 4:
+        return 0, np.nan
+
+    # Recenter
+    pbcc.recenter_points(pos, center, pos)
+
+    try:
+        hull = ConvexHull(pos)
+    except QhullError:
+        return None, None
+
+    return hull.volume, hull.area
@@ -1,6 +1,8 @@
 
 import numpy as np
 
+import os
+
 DEFAULT_SOAP_PARAMS = {
     'cutoff' : 3.0,
     'l_max' : 6, 'n_max' : 6,
@@ -10,7 +12,11 @@ DEFAULT_SOAP_PARAMS = {
     'periodic' : True,
 }
 
-def dscribe_soap_backend(soap_params = {}):
+def dscribe_soap_backend(soap_params = {}, n_jobs = None):
+    """
+    :param int n_jobs: How many processes DScribe computes a batch of frames
+        in. Defaults to the number of CPUs.
+    """
     from dscribe.descriptors import SOAP
 
     soap_opts = dict(DEFAULT_SOAP_PARAMS)
@@ -30,10 +36,19 @@ def dscribe_soap_backend(soap_params = {}):
         )
 
         def dscribe_soap(structure, positions):
-            out = soap.create(structure, positions = positions).astype(np.float)
+            out = soap.create(structure, positions = positions).astype(np.float64, copy = False)
             return out
 
+        def dscribe_soap_batch(structures, positions):
+            out = soap.create(structures,
+                              positions = positions,
+                              n_jobs = min(n_jobs or os.cpu_count() or 1, len(structures)))
+            if isinstance(out, list):
+                out = np.concatenate(out)
+            return out.reshape(-1, dscribe_soap.n_dim).astype(np.float64, copy = False)
+
         dscribe_soap.n_dim = soap.get_number_of_features()
+        dscribe_soap.batch = dscribe_soap_batch
 
         return dscribe_soap
 
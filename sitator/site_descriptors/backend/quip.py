@@ -73,7 +73,7 @@ def _soap(descriptor_str,
     soaps = []
     for line in lines:
         if line.startswith("DESC"):
-            soaps.append(np.fromstring(line.lstrip("DESC"), dtype = np.float, sep = ' '))
+            soaps.append(np.fromstring(line.lstrip("DESC"), dtype = np.float64, sep = ' '))
         elif line.startswith("Error"):
             e = subprocess.CalledProcessError(returncode = 0, cmd = quip_cmd)
             e.stdout = result
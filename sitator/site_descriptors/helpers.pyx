@@ -0,0 +1,126 @@
+# cython: language_level=3
+
+import numpy as np
+
+cimport cython
+from cython.parallel cimport prange
+
+from sitator import SiteTrajectory
+
+ctypedef double precision
+ctypedef Py_ssize_t site_int
+
+ctypedef fused desc_precision:
+    float
+    double
+
+# Width, in SOAP components, of the column blocks accumulate_soaps splits
+# between threads
+cdef enum:
+    COLUMN_BLOCK = 64
+
+
+cpdef Py_ssize_t select_to_describe(const site_int [:] site_traj_t,
+                                    const site_int [:] mob_indices,
+                                    const unsigned char [:] allowed,
+                                    unsigned char [:] taken,
+                                    site_int [:] atom_out,
+                                    site_int [:] site_out):
+    """Find the mobile atoms whose SOAPs should be computed at this frame.
+
+    Each allowed site is described at most once per frame, even if more than
+    one mobile atom is assigned to it; then the last of those atoms is used.
+
+    Writes the indexes (into the full structure, through ``mob_indices``) of
+    the atoms to describe into ``atom_out``, and their sites into ``site_out``.
+    ``taken`` is a scratch buffer of length ``n_sites`` that must be all zero;
+    it is left all zero.
+
+    Returns:
+        The number of atoms to describe.
+    """
+    cdef site_int s_unknown = SiteTrajectory.SITE_UNKNOWN
+    cdef Py_ssize_t n = 0
+    cdef site_int s
+
+    # Go backwards so that the last atom at a site is the one kept
+    for i in range(site_traj_t.shape[0] - 1, -1, -1):
+        s = site_traj_t[i]
+        if s == s_unknown or not allowed[s] or taken[s]:
+            continue
+        taken[s] = True
+        atom_out[n] = mob_indices[i]
+        site_out[n] = s
+        n += 1
+
+    for j in range(n):
+        taken[site_out[j]] = False
+
+    return n
+
+
+cpdef void advance_frame(const site_int [:] sites_to_describe,
+                         const site_int [:] averagings,
+                         site_int [:] desc_index,
+                         const site_int [:] max_index,
+                         site_int [:] count_of_site,
+                         unsigned char [:] allowed,
+                         site_int [:] rows_out):
+    """Do one frame's bookkeeping of the running averages, IN PLACE.
+
+    Writes the row of ``descs`` that the SOAP of an atom at
+    ``sites_to_describe[j]`` belongs to into ``rows_out[j]``. Sites whose
+    current average is then complete move on to their next descriptor, and
+    sites with all their descriptors complete are no longer ``allowed``.
+
+    This depends only on which sites were described, not on the SOAPs
+    themselves, so it can run ahead of the SOAP computations. Each site must
+    appear at most once in ``sites_to_describe``.
+    """
+    cdef site_int s
+
+    for j in range(sites_to_describe.shape[0]):
+        s = sites_to_describe[j]
+        rows_out[j] = desc_index[s]
+        count_of_site[s] += 1
+        # Reset and increment full averages; only sites described at this
+        # frame can have become full.
+        if count_of_site[s] == averagings[s]:
+            desc_index[s] += 1
+            count_of_site[s] = 0
+            if desc_index[s] == max_index[s]:
+                allowed[s] = False
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+@cython.cdivision(True)
+cpdef void accumulate_soaps(const site_int [:] rows,
+                            const site_int [:] sites,
+                            const precision [:, :] soaps,
+                            const precision [:] inv_averagings,
+                            desc_precision [:, :] descs):
+    """Add ``soaps[j] * inv_averagings[sites[j]]`` to ``descs[rows[j]]``, IN PLACE.
+
+    ``descs`` can be single or double precision.
+
+    The same row can appear more than once in a batch, so rather than splitting
+    up the SOAPs, threads each take a block of columns of all of them. This
+    only runs in parallel if the package was built with OpenMP (see
+    ``SITATOR_OPENMP_FLAG`` in ``setup.py``); otherwise it runs serially.
+    """
+    cdef Py_ssize_t n = rows.shape[0]
+    cdef Py_ssize_t n_dim = soaps.shape[1]
+    cdef Py_ssize_t n_blocks = (n_dim + COLUMN_BLOCK - 1) // COLUMN_BLOCK
+    cdef Py_ssize_t block, j, k, k_end, idx
+    cdef precision inv
+
+    for block in prange(n_blocks, nogil = True, schedule = 'static'):
+        k_end = (block + 1) * COLUMN_BLOCK
+        if k_end > n_dim:
+            k_end = n_dim
+        for j in range(n):
+            inv = inv_averagings[sites[j]]
+            idx = rows[j]
+            for k in range(block * COLUMN_BLOCK, k_end):
+                descs[idx, k] += <desc_precision>(soaps[j, k] * inv)
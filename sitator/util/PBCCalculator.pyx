@@ -364,3 +364,42 @@ cdef class PBCCalculator(object):
                 buf[dim] = (cell[dim, 0]*pt[0] + cell[dim, 1]*pt[1] + cell[dim, 2]*pt[2])
 
             points[i, 0] = buf[0]; points[i, 1] = buf[1]; points[i, 2] = buf[2];
+
+
+    cpdef void recenter_points(self,
+                               const precision [:, :] points,
+                               const precision [:] center,
+                               precision [:, :] out):
+        """Shift ``points`` so ``center`` is at the cell centroid and wrap them into ``out``. 3D only.
+
+        Equivalent to ``out[:] = points + (cell_centroid - center)`` followed
+        by ``wrap_points(out)``, in one pass. ``out`` can be ``points``.
+        """
+
+        assert points.shape[1] == 3, "Points must be 3D"
+        assert out.shape[0] == points.shape[0] and out.shape[1] == 3, "`out` must have the same shape as `points`"
+
+        cdef cell_precision [:, :] cell = self._cell_mat_array
+        cdef cell_precision [:, :] cell_I = self._cell_mat_inverse_array
+
+        cdef precision buf[3]
+        cdef precision pt[3]
+        cdef precision offset[3]
+
+        for dim in xrange(3):
+            offset[dim] = self._cell_centroid[dim] - center[dim]
+
+        # Iterates over points
+        for i in xrange(len(points)):
+            pt[0] = points[i, 0] + offset[0]; pt[1] = points[i, 1] + offset[1]; pt[2] = points[i, 2] + offset[2];
+
+            for dim in xrange(3):
+                buf[dim] = (cell_I[dim, 0]*pt[0] + cell_I[dim, 1]*pt[1] + cell_I[dim, 2]*pt[2])
+                buf[dim] -= floor(buf[dim])
+
+            pt[0] = buf[0]; pt[1] = buf[1]; pt[2] = buf[2];
+
+            for dim in xrange(3):
+                buf[dim] = (cell[dim, 0]*pt[0] + cell[dim, 1]*pt[1] + cell[dim, 2]*pt[2])
+
+            out[i, 0] = buf[0]; out[i, 1] = buf[1]; out[i, 2] = buf[2];
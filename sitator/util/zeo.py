@@ -12,15 +12,12 @@ import re
 import numpy as np
 
 import ase
-import ase.io
 
 from sitator.util import PBCCalculator
 
 import logging
 logger = logging.getLogger(__name__)
 
-# TODO: benchmark CUC vs CIF
-
 class Zeopy(object):
     """A wrapper for the Zeo++ ``network`` tool.
 
@@ -51,14 +48,14 @@ class Zeopy(object):
         if self._tmpdir is None:
             raise ValueError("Cannot use Zeopy outside with statement")
 
-        inp = os.path.join(self._tmpdir, "in.cif")
+        # Zeo++ picks the input format from the extension
+        inp = os.path.join(self._tmpdir, "in.cuc")
         outp = os.path.join(self._tmpdir, "out.nt2")
         v1out = os.path.join(self._tmpdir, "out.v1")
 
-        ase.io.write(inp, structure, parallel = False)
-
-        # with open(inp, "w") as inf:
-        #     inf.write(self.ase2cuc(structure))
+        with open(inp, "w") as inf:
+            inf.write(self.ase2cuc(structure))
+            inf.write("\n")
 
         args = []
 
@@ -76,7 +73,7 @@ class Zeopy(object):
         logger.debug(output)
 
         with open(outp, "r") as outf:
-            verts, edges = self.parse_nt2(outf.readlines())
+            vert_coords, _, vert_regions, edges, edge_radius = self.parse_nt2(outf)
         with open(v1out, "r") as outf:
             zeocell = self.parse_v1_cell(outf.readlines())
 
@@ -85,8 +82,6 @@ class Zeopy(object):
         # it just rotates them.
         assert np.all(np.linalg.norm(zeocell, axis = 1) - np.linalg.norm(structure.cell, axis = 1) < 0.0001)
 
-        vert_coords = np.asarray([v['coords'] for v in verts])
-
         zeopbcc = PBCCalculator(zeocell)
         real_pbcc = PBCCalculator(structure.cell[:])
 
@@ -95,16 +90,9 @@ class Zeopy(object):
         # Bring into our real coords
         real_pbcc.to_real_coords(vert_coords)
 
-        edges_np = np.empty(shape = (len(edges), 2), dtype = np.int)
-        edge_radius = np.empty(shape = len(edges), dtype = np.float)
-        for i, edge in enumerate(edges):
-            edges_np[i, 0] = edge['from']
-            edges_np[i, 1] = edge['to']
-            edge_radius[i] = edge['radius']
-
         return (vert_coords,
-               [v['region-atom-indexes'] for v in verts],
-               edges_np,
+               vert_regions,
+               edges,
                edge_radius)
 
 
@@ -117,10 +105,11 @@ class Zeopy(object):
         :returns: A string in CUC format.
         """
         ls = ["Autogenerated"]
-        c = at.get_cell_lengths_and_angles()
+        c = at.cell.cellpar()
         ls.append("Unit_cell: {:0.16f} {:0.16f} {:0.16f} {:0.16f} {:0.16f} {:0.16f}".format(*c))
-        for sym, pos in zip(at.get_chemical_symbols(), at.get_scaled_positions()):
-            ls.append("{} {:0.16f} {:0.16f} {:0.16f}".format(sym, *pos))
+        # Format all coordinates at once, then join each atom's line
+        scaled = np.char.mod("%0.16f", at.get_scaled_positions())
+        ls.extend(map(" ".join, zip(at.get_chemical_symbols(), *scaled.T)))
 
         return "\n".join(ls)
 
@@ -131,7 +120,7 @@ class Zeopy(object):
         # First line is just "Unit cell vectors:"
         assert next(v1lines).strip() == "Unit cell vectors:"
         # Unit cell:
-        cell = np.empty(shape = (3, 3), dtype = np.float)
+        cell = np.empty(shape = (3, 3), dtype = np.float64)
         cellvec_re = re.compile('v[abc]=')
         for i in range(3):
             cellvec = next(v1lines).strip().split()
@@ -142,41 +131,106 @@ class Zeopy(object):
 
     @staticmethod
     def parse_nt2(nt2lines):
+        """Parse a Zeo++ ``.nt2`` file.
 
+        :param nt2lines: The lines of the file, or the open file itself, which
+            is then streamed through twice instead of being read into memory.
+            Any other iterable that can't be rewound is read into a list first.
+
+        :returns: The vertex coordinates (ndarray n_verts x 3), the vertex radii
+            (ndarray n_verts), a list of the indexes of the atoms defining each
+            vertex's region, the edges (ndarray n_edges x 2 of vertex indexes),
+            and the edge radii (ndarray n_edges).
+        """
+        if not hasattr(nt2lines, 'seek'):
+            # Has to be gone through twice
+            nt2lines = list(nt2lines)
+
+        # Count first so the output can be allocated up front
         where = None
+        n_verts = 0
+        n_edges = 0
+        for l in nt2lines:
+            if not l.strip():
+                continue
+            elif l.startswith("Vertex table:"):
+                where = 'vertex'
+            elif l.startswith("Edge table:"):
+                where = 'edge'
+            elif where == 'vertex':
+                n_verts += 1
+            elif where == 'edge':
+                n_edges += 1
+            else:
+                raise RuntimeError("Huh?")
 
-        vertices = []
-        edges = []
+        vert_coords = np.empty(shape = (n_verts, 3), dtype = np.float64)
+        vert_radius = np.empty(shape = n_verts, dtype = np.float64)
+        vert_regions = [None] * n_verts
+        edges = np.empty(shape = (n_edges, 2), dtype = np.int64)
+        edge_radius = np.empty(shape = n_edges, dtype = np.float64)
+        edge_lines = []
 
+        if hasattr(nt2lines, 'seek'):
+            nt2lines.seek(0)
+
+        where = None
+        i = 0
+        verts_read = 0
+        edges_read = 0
         for l in nt2lines:
             if not l.strip():
                 continue
             elif l.startswith("Vertex table:"):
                 where = 'vertex'
+                i = 0
             elif l.startswith("Edge table:"):
                 where = 'edge'
+                i = 0
             elif where == 'vertex':
                 # Line format:
                 # [node_number:int] [x] [y] [z] [radius] [region-vertex-atom-indexes]
                 e = l.split()
-                vertices.append({
-                    'number' : int(e[0]),
-                    'coords' : np.asarray([float(f) for f in e[1:4]]),
-                    'radius' : float(e[4]),
-                    'region-atom-indexes' : [int(i) for i in e[5:]]
-                })
+                vert_coords[i] = (float(e[1]), float(e[2]), float(e[3]))
+                vert_radius[i] = float(e[4])
+                vert_regions[i] = [int(j) for j in e[5:]]
+                i += 1
+                verts_read += 1
             elif where == 'edge':
-                # Line format:
-                # [from node] -> [to node] [radius] [delta uc x] ['' y] ['' z] [length]
+                edge_lines.append(l)
+                if len(edge_lines) == _NT2_EDGE_CHUNK:
+                    _parse_nt2_edges(edge_lines, edges[i:], edge_radius[i:])
+                    i += len(edge_lines)
+                    edges_read += len(edge_lines)
+                    del edge_lines[:]
 
-                # TODO: For now, just ignore everything but from and to
-                e = l.split()
-                edges.append({
-                    'from' : int(e[0]),
-                    'to' : int(e[2]),
-                    'radius' : float(e[3])
-                })
-            else:
-                raise RuntimeError("Huh?")
+        if len(edge_lines) > 0:
+            _parse_nt2_edges(edge_lines, edges[i:], edge_radius[i:])
+            edges_read += len(edge_lines)
 
-        return vertices, edges
+        if verts_read != n_verts or edges_read != n_edges:
+            raise RuntimeError("nt2 input changed between passes: counted %i vertices and %i edges, but read %i and %i" % (n_verts, n_edges, verts_read, edges_read))
+
+        return vert_coords, vert_radius, vert_regions, edges, edge_radius
+
+
+# How many edge lines to convert at once when parsing an nt2 file
+_NT2_EDGE_CHUNK = 4096
+# Whitespace separated fields on an nt2 edge line, counting the ``->``
+_NT2_EDGE_FIELDS = 8
+
+def _parse_nt2_edges(edge_lines, edges, edge_radius):
+    """Convert a block of nt2 edge lines into ``edges`` and ``edge_radius``.
+
+    Edge lines all have the same format, so the block is converted at once:
+    [from node] -> [to node] [radius] [delta uc x] ['' y] ['' z] [length]
+
+    Only from, to, and radius are kept.
+    """
+    n = len(edge_lines)
+    edge_table = np.asarray(" ".join(edge_lines).split(), dtype = np.str_)
+    if len(edge_table) != n * _NT2_EDGE_FIELDS:
+        raise RuntimeError("Expected %i fields on each of %i nt2 edge lines, got %i in total" % (_NT2_EDGE_FIELDS, n, len(edge_table)))
+    edge_table = edge_table.reshape(n, _NT2_EDGE_FIELDS)
+    edges[:n] = edge_table[:, [0, 2]].astype(np.int64)
+    edge_radius[:n] = edge_table[:, 3].astype(np.float64)